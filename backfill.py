@@ -0,0 +1,76 @@
+import json
+import argparse
+from datetime import datetime, timezone
+from usm2jira import *
+
+
+def parse_time(value):
+
+    if value.isdigit():
+        return int(value)
+
+    for fmt in ['%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M', '%Y-%m-%d']:
+        try:
+            dt = datetime.strptime(value, fmt).replace(tzinfo=timezone.utc)
+            return int(dt.timestamp() * 1000)
+        except ValueError:
+            continue
+
+    raise argparse.ArgumentTypeError(
+        'Time should be epoch millis or YYYY-mm-dd[THH:MM[:SS]] '
+        'in UTC: %s' % (value))
+
+
+def main():
+
+    parser = argparse.ArgumentParser(
+        description='Backfill USM alarms to JIRA for a given time range.')
+    parser.add_argument('start', type=parse_time,
+                        help='Start of time range (UTC).')
+    parser.add_argument('end', type=parse_time,
+                        help='End of time range (UTC).')
+    parser.add_argument('--slice', type=int, default=60,
+                        help='Size of each time slice in minutes.')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='Number of time slices fetched in parallel.')
+    parser.add_argument('--checkpoint', default='backfill_checkpoint.json',
+                        help='File to record completed time slices in.')
+    args = parser.parse_args()
+
+    if args.start >= args.end:
+        parser.error('Start time should be before end time.')
+    if args.slice < 1:
+        parser.error('Slice size should be at least 1 minute.')
+    if args.workers < 1:
+        parser.error('Number of workers should be at least 1.')
+
+    config = read_config()
+    if not config['jira'].get('interval'):
+        exit('`interval` field of `jira` is required for backfill to '
+             'check duplicates against JIRA. Exiting program.\n')
+    if not get_auth_token(config):
+        exit('Could not retrieve USM token. Exiting program.\n')
+
+    issues = get_jira_issues(config, max_results=None)
+    if issues is None:
+        exit('Could not fetch JIRA issues for duplicate checks. '
+             'Exiting program.\n')
+    projects = get_jira_projects(config)
+    issue_types = get_jira_issue_types(config)
+    jira_users = get_jira_users(config)
+
+    responses, failed = backfill_usm_alarms(
+        config, args.start, args.end, issues, projects,
+        issue_types, jira_users, slice_minutes=args.slice,
+        workers=args.workers, checkpoint_file=args.checkpoint)
+
+    if responses:
+        alert_on_slack(responses, config)
+    print(json.dumps(responses, indent=2))
+
+    if failed:
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -7,8 +7,10 @@ def main(event, context):
     config = read_config()
     token = get_auth_token(config)
     alarms = get_usm_alarms(config, token)
+    if alarms is None:
+        exit('Could not fetch USM alarms. Exiting program.\n')
 
-    issues = get_jira_issues(config)
+    issues = get_jira_issues(config) or list()
     projects = get_jira_projects(config)
     issue_types = get_jira_issue_types(config)
     jira_users = get_jira_users(config)
@@ -2,5 +2,6 @@ from .__script__ import (
     read_config, get_auth_token, get_usm_alarms,
     get_jira_issues, get_jira_projects, get_jira_issue_types,
     get_jira_users, filter_alarms, filter_duplicate_tickets,
-    tickets_from_alarms, push_tickets, alert_on_slack
+    tickets_from_alarms, push_tickets, alert_on_slack,
+    backfill_usm_alarms
 )
@@ -3,11 +3,14 @@ import re
 import time
 import json
 import time
+import copy
 import logging
 import hashlib
 import requests
+import threading
 import opencrypt
 from urllib.parse import urljoin
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 
 logger = logging.getLogger(__name__)
@@ -137,31 +140,58 @@ def get_auth_token(config):
     return None
 
 
-def get_usm_alarms(config, token):
+def get_usm_alarms(config, token, start=None, end=None):
 
     usm = config['usm']
-    curr_time = str(time.time()).replace('.', str())[:13]
-    prev_time = str(int(curr_time) - (int(usm.get(
-        'interval', '10')) * 60 * 1000))
-    params = ['sort=timestamp_occured,desc',
-              'timestamp_occured_gte=' + prev_time]
+    if start is None:
+        curr_time = str(time.time()).replace('.', str())[:13]
+        start = int(curr_time) - (int(usm.get(
+            'interval', '10')) * 60 * 1000)
+
+    # Alarms are paged oldest first, so alarms arriving during the scan
+    # are appended to the last page instead of shifting earlier ones.
+    params = ['sort=timestamp_occured,asc',
+              'timestamp_occured_gte=' + str(start),
+              'size=%s' % (usm.get('page_size', '100'))]
+    if end is not None:
+        # Time windows are half-open so that neighbouring slices don't
+        # both fetch alarms occurring exactly at their boundary.
+        params.append('timestamp_occured_lte=' + str(end - 1))
 
-    url = urljoin(usm.get('api_url'), 'alarms?%s' % ('&'.join(params)))
     logger.info('Retrieving USM alarms...')
-    res = requests.get(url, headers={'Authorization': 'Bearer ' + token})
-    if res.status_code < 300:
-        alarms = res.json().get('_embedded', dict()).get('alarms', list())
-        if not alarms:
-            logger.info('USM has no alarms in given interval. '
-                        'Exiting program.')
-            exit(0)
+    alarms, uuids, page, total = (list(), set(), 0, 0)
+    while True:
+        url = urljoin(usm.get('api_url'), 'alarms?%s' % (
+            '&'.join(params + ['page=%d' % (page)])))
+        res = requests.get(url, headers={'Authorization': 'Bearer ' + token})
+        if res.status_code >= 300:
+            logger.info('Unexpected response returned: %s', res)
+            return None
+
+        content = res.json()
+        for alarm in content.get('_embedded', dict()).get('alarms', list()):
+            if alarm.get('uuid') not in uuids:
+                uuids.add(alarm.get('uuid'))
+                alarms.append(alarm)
+        total = content.get('page', dict()).get('totalElements', len(alarms))
+
+        page += 1
+        if page >= content.get('page', dict()).get('totalPages', 0):
+            break
 
-        logger.info('[%d] alarms fetched from USM.', len(alarms))
-        logger.info(str())
-        return alarms
+    if len(alarms) < total:
+        logger.info('Only [%d/%d] alarms could be fetched from USM.',
+                    len(alarms), total)
+        return None
 
-    logger.info('Unexpected response returned: %s', res)
-    return None
+    if not alarms:
+        logger.info('USM has no alarms in given interval. '
+                    'Exiting program.')
+        exit(0)
+
+    logger.info('[%d] alarms fetched from USM.', len(alarms))
+    logger.info(str())
+    return alarms
 
 
 def get_jira_projects(config):
@@ -228,19 +258,24 @@ def get_jira_issue_types(config):
     return None
 
 
-def get_jira_issues(config):
+def get_jira_issues(config, max_results=200):
 
     jira = config['jira']
     url = urljoin(jira.get('api_url'), 'search')
     logger.info('Retrieving JIRA issues...')
 
     if not(jira.get('project_key') and jira.get('interval')):
-        logger.info('JIRA project and/or interval for issues are '
-                    'missing in config. Only the latest 100 issues '
-                    'will be considered.')
+        if max_results:
+            logger.info('JIRA project and/or interval for issues are '
+                        'missing in config. Only the latest %d issues '
+                        'will be considered.', max_results)
+        else:
+            logger.info('JIRA project and/or interval for issues are '
+                        'missing in config. All issues will be fetched, '
+                        'which can take long for large projects.')
 
     query = dict()
-    query['maxResults'] = 200
+    query['maxResults'] = 100
     query['fields'] = ['assignee', 'summary',
                        'description', 'created', 'updated']
     if jira.get('project_key') or jira.get('interval'):
@@ -253,30 +288,39 @@ def get_jira_issues(config):
         jql = ' AND '.join([x for x in jql if x])
         query['jql'] = jql
 
-    logger.debug('Using query: %s', query)
-    res = requests.post(url, json=query, auth=(
-        jira.get('username'), jira.get('api_token')))
+    issues = list()
+    while True:
+        query['startAt'] = len(issues)
+        logger.debug('Using query: %s', query)
+        res = requests.post(url, json=query, auth=(
+            jira.get('username'), jira.get('api_token')))
 
-    if res.status_code < 300:
-        issues = res.json().get('issues', list())
-        logger.info('[%d] issues fetched from JIRA.', len(issues))
-        logger.info(str())
+        if res.status_code >= 300:
+            logger.info('Unexpected response returned: %s', res.json())
+            return None
 
-        for issue in issues:
-            url = urljoin(
-                jira.get('api_url'),
-                'issue/%s/properties/_data' % issue.get('id'))
+        page = res.json().get('issues', list())
+        issues.extend(page)
+        if not page or len(issues) >= res.json().get('total', 0) or (
+                max_results and len(issues) >= max_results):
+            break
 
-            res = requests.get(url, auth=(
-                jira.get('username'), jira.get('api_token')))
+    issues = issues[:max_results] if max_results else issues
+    logger.info('[%d] issues fetched from JIRA.', len(issues))
+    logger.info(str())
+
+    for issue in issues:
+        url = urljoin(
+            jira.get('api_url'),
+            'issue/%s/properties/_data' % issue.get('id'))
 
-            if res.status_code < 300 and res.json().get('value'):
-                issue['properties'] = res.json().get('value')
+        res = requests.get(url, auth=(
+            jira.get('username'), jira.get('api_token')))
 
-        return issues
+        if res.status_code < 300 and res.json().get('value'):
+            issue['properties'] = res.json().get('value')
 
-    logger.info('Unexpected response returned: %s', res.json())
-    return list()
+    return issues
 
 
 def get_jira_users(config):
@@ -390,7 +434,7 @@ def tickets_from_alarms(alarms, config):
         tickets.append(ticket)
 
     for ticket in tickets:
-        ticket_template = ticket['template']
+        ticket_template = copy.deepcopy(ticket['template'])
         if not ticket_template:
             continue
 
@@ -427,6 +471,13 @@ def tickets_from_alarms(alarms, config):
     return tickets
 
 
+def get_ticket_hash(ticket):
+
+    return hashlib.md5(json.dumps({
+        x: y for x, y in ticket['template'].items()
+        if x in ['title', 'description']}).encode('utf8')).hexdigest()
+
+
 def filter_duplicate_tickets(issues, tickets):
 
     filtered = list()
@@ -437,9 +488,7 @@ def filter_duplicate_tickets(issues, tickets):
         if not ticket.get('template'):
             continue
 
-        template_hash = hashlib.md5(json.dumps({
-            x: y for x, y in ticket['template'].items()
-            if x in ['title', 'description']}).encode('utf8')).hexdigest()
+        template_hash = get_ticket_hash(ticket)
 
         if template_hash not in posted_md5s:
             filtered.append(ticket)
@@ -565,9 +614,7 @@ def push_tickets(tickets, projects, issue_types, users, config):
             jira.get('api_url'),
             'issue/%s/properties/_data' % (res.get('id')))
 
-        template_hash = hashlib.md5(json.dumps({
-            x: y for x, y in ticket['template'].items()
-            if x in ['title', 'description']}).encode('utf8')).hexdigest()
+        template_hash = get_ticket_hash(ticket)
         requests.put(
             url, json={
                 'alarm-uuid': ticket.get('_uuid'),
@@ -624,3 +671,144 @@ def alert_on_slack(data, config):
         else:
             logger.info('Could not push message to slack: <(%s) %s>' % (
                 response.status_code, response.content.decode('utf8')))
+
+
+def get_time_slices(start, end, slice_minutes):
+
+    if int(slice_minutes) < 1:
+        raise ValueError('Slice size should be at least 1 minute.')
+
+    slices = list()
+    step = int(slice_minutes) * 60 * 1000
+    while start < end:
+        slices.append((start, min(start + step, end)))
+        start += step
+
+    return slices
+
+
+def read_checkpoint(checkpoint_file):
+
+    if not(checkpoint_file and os.path.isfile(checkpoint_file)):
+        return list()
+
+    try:
+        content = json.loads(open(checkpoint_file, 'r').read())
+        return content.get('slices', list())
+    except json.JSONDecodeError:
+        logger.info('Could not parse checkpoint file: %s', checkpoint_file)
+        exit(1)
+
+
+def write_checkpoint(checkpoint_file, slices):
+
+    if not checkpoint_file:
+        return
+
+    temp_file = checkpoint_file + '.tmp'
+    with open(temp_file, 'w') as f:
+        f.write(json.dumps({'slices': sorted(slices)}, indent=2))
+    os.replace(temp_file, checkpoint_file)
+
+
+def process_time_slice(time_slice, issues, projects,
+                       issue_types, users, config, lock):
+
+    start, end = time_slice
+
+    # A fresh token is fetched for each slice so that a long backfill
+    # doesn't outlive it.
+    token = get_auth_token(config)
+    if not token:
+        raise RuntimeError('Could not retrieve USM token.')
+
+    try:
+        alarms = get_usm_alarms(config, token, start, end)
+        if alarms is None:
+            raise RuntimeError('Could not fetch USM alarms.')
+
+        with lock:
+            filtered_alarms = filter_alarms(alarms, issues, config)
+        tickets = tickets_from_alarms(filtered_alarms, config)
+    except SystemExit as exc:
+        # Pipeline steps exit with code 0 when nothing is left to push.
+        if exc.code:
+            raise RuntimeError(exc.code)
+        return list()
+
+    # Pushing is serialized so that tickets pushed by one slice are
+    # visible to the duplicate checks of the others.
+    with lock:
+        try:
+            tickets = filter_duplicate_tickets(issues, tickets)
+        except SystemExit as exc:
+            if exc.code:
+                raise RuntimeError(exc.code)
+            return list()
+
+        responses = push_tickets(
+            tickets, projects, issue_types, users, config)
+        if responses is None:
+            raise RuntimeError('Could not push tickets to JIRA.')
+
+        for ticket, response in zip(tickets, responses):
+            if not response.get('response', dict()).get('key'):
+                continue
+            issues.append({'properties': {
+                'alarm-uuid': ticket['_uuid'],
+                'alarm-md5': get_ticket_hash(ticket)}})
+
+    return responses
+
+
+def backfill_usm_alarms(config, start, end, issues, projects,
+                        issue_types, users, slice_minutes=60, workers=4,
+                        checkpoint_file=None):
+
+    slices = get_time_slices(start, end, slice_minutes)
+    completed = [tuple(x) for x in read_checkpoint(checkpoint_file)]
+    pending = [x for x in slices if x not in completed]
+    logger.info('[%d/%d] time slices pending for backfill.',
+                len(pending), len(slices))
+
+    lock = threading.Lock()
+    responses = list()
+    failed = list()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(
+            process_time_slice, time_slice, issues, projects,
+            issue_types, users, config, lock): time_slice
+            for time_slice in pending}
+
+        for future in as_completed(futures):
+            time_slice = futures[future]
+            try:
+                slice_responses = future.result()
+            except Exception as exc:
+                logger.info('Time slice [%d - %d] failed: %s',
+                            time_slice[0], time_slice[1], exc)
+                failed.append(time_slice)
+                continue
+
+            responses.extend(slice_responses)
+            erred = [x for x in slice_responses if not x.get(
+                'response', dict()).get('key')]
+            if erred:
+                logger.info('Time slice [%d - %d] failed: [%d/%d] tickets '
+                            'could not be pushed to JIRA.', time_slice[0],
+                            time_slice[1], len(erred), len(slice_responses))
+                failed.append(time_slice)
+                continue
+
+            with lock:
+                completed.append(time_slice)
+                write_checkpoint(checkpoint_file, completed)
+
+    logger.info('[%d/%d] time slices backfilled successfully.',
+                len(pending) - len(failed), len(pending))
+    if failed:
+        logger.info('Re-run with same checkpoint file to retry '
+                    'failed time slices.')
+
+    return responses, failed